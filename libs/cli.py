@@ -4,10 +4,12 @@ import sys
 import argparse
 import argcomplete  # type: ignore
 import platform
+import functools
 
 
-def get_parser() -> argparse.ArgumentParser:
-    """Create and return the argument parser for the Metronome CLI."""
+@functools.lru_cache(maxsize=1)
+def _build_parser() -> argparse.ArgumentParser:
+    """Build the argument parser once; repeated callers share the same object."""
     parser = argparse.ArgumentParser(
         prog="Metronome",
         description="A swiss-army knife to convert, sort, and analyze your music library.",
@@ -43,6 +45,18 @@ def get_parser() -> argparse.ArgumentParser:
         help="Number of threads to use for conversion",
         default=os.cpu_count() or 2,
     )
+    parser.add_argument(
+        "--ffmpeg-threads",
+        help="Threads each ffmpeg process may use (default: CPU cores split between conversion threads, 0 lets ffmpeg decide).",
+        type=int,
+        default=None,
+    )
+    parser.add_argument(
+        "--probe",
+        help="Run ffprobe on non-FLAC files to size their progress bars; disable to skip one extra process per file.",
+        default=True,
+        action=argparse.BooleanOptionalAction,
+    )
     parser.add_argument(
         "-s",
         "--sort",
@@ -120,6 +134,12 @@ def get_parser() -> argparse.ArgumentParser:
         type=lambda s: [ext.strip() for ext in s.split(",")] if s else [],
         default=[],
     )
+    parser.add_argument(
+        "--save-settings",
+        help="Save the settings used for this run to ~/.metronome.json once it completes.",
+        default=True,
+        action=argparse.BooleanOptionalAction,
+    )
     parser.add_argument(
         "--log-level",
         help="Set log level: info, log, warn, debug (default: warn)",
@@ -132,69 +152,100 @@ def get_parser() -> argparse.ArgumentParser:
         action="store_true",
     )
 
-    # Add autocomplete support
-    argcomplete.autocomplete(parser)
+    return parser
 
-    # Handle --install-completion before parsing other args
-    if "--install-completion" in sys.argv:
-        if platform.system() == "Windows":
-            print("Argcomplete is not supported on Windows (Powershell or CMD).")
-            sys.exit(0)
-
-        script_path = os.path.abspath(sys.argv[0])
-        completion_cmd = f'eval "$(register-python-argcomplete {script_path})"'
-
-        shell = os.environ.get("SHELL", "")
-        home = str(pathlib.Path.home())
-
-        if "zsh" in shell:
-            rc_file = os.path.join(home, ".zshrc")
-        elif "bash" in shell:
-            rc_file = os.path.join(home, ".bashrc")
-        elif "fish" in shell:
-            rc_file = os.path.join(home, ".config/fish/config.fish")
-            completion_cmd = f"register-python-argcomplete {script_path} | source"
-        else:
-            rc_file = None
-
-        if rc_file:
-            # Append to rc file if not already present
-            with open(rc_file, "a+") as f:
-                f.seek(0)
-                contents = f.read()
-                if completion_cmd not in contents:
-                    f.write(f"\n# Enable argcomplete for Metronome\n{completion_cmd}\n")
-            print(f"Added completion to {rc_file}")
-
-            # Source the rc file in the current shell if possible
-            if "bash" in shell or "zsh" in shell:
-                os.system(f". {rc_file}")
-                print(
-                    f"Sourced {rc_file}. Completion should now be available in this shell."
-                )
-            elif "fish" in shell:
-                os.system(f"{completion_cmd}")
-                print(
-                    "Sourced fish config. Completion should now be available in this shell."
-                )
-            else:
-                print("Please restart your shell or source your rc file manually.")
-        else:
-            print(completion_cmd)
-            print(
-                "Could not detect your shell. Please add the above line to your shell rc file manually."
-            )
 
-        print(
-            "Make sure ~/.local/bin is in your PATH to use this script with completion."
-        )
-        sys.exit(0)
+def get_parser() -> argparse.ArgumentParser:
+    """Create and return the argument parser for the Metronome CLI."""
+    parser = _build_parser()
+
+    # Add autocomplete support; do this before any other work so Tab completion
+    # short-circuits as early as possible
+    argcomplete.autocomplete(parser)
 
     if len(sys.argv) == 1:
         parser.print_help()
         print("Please select at least one option to begin.")
         exit()
 
-    # Initialize argcomplete for the parser
-    argcomplete.autocomplete(parser)
     return parser
+
+
+def install_completion() -> None:
+    """Write a static shell completion script for this script and exit."""
+    import subprocess
+
+    if platform.system() == "Windows":
+        print("Argcomplete is not supported on Windows (Powershell or CMD).")
+        sys.exit(0)
+
+    script_path = os.path.abspath(sys.argv[0])
+    script_name = os.path.basename(script_path)
+
+    shell = os.environ.get("SHELL", "")
+    home = pathlib.Path.home()
+    data_dir = home / ".local" / "share" / "metronome"
+
+    if "zsh" in shell:
+        shell_name = "zsh"
+        rc_file = home / ".zshrc"
+        completion_file = data_dir / "completion.zsh"
+    elif "bash" in shell:
+        shell_name = "bash"
+        rc_file = home / ".bashrc"
+        completion_file = data_dir / "completion.bash"
+    elif "fish" in shell:
+        # fish autoloads completions by command name, so no rc entry is needed
+        shell_name = "fish"
+        rc_file = None
+        completion_file = home / ".config" / "fish" / "completions" / f"{script_name}.fish"
+    else:
+        print(f'eval "$(register-python-argcomplete {script_path})"')
+        print(
+            "Could not detect your shell. Please add the above line to your shell rc file manually."
+        )
+        sys.exit(0)
+
+    # Generate the completion script once instead of evaluating it on every shell startup
+    try:
+        completion = subprocess.run(
+            ["register-python-argcomplete", "--shell", shell_name, script_path],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout
+    except OSError as e:
+        print(f"Unable to generate completion script: {e}")
+        sys.exit(1)
+    except subprocess.CalledProcessError:
+        # argcomplete < 3 can't generate zsh scripts, evaluate it on shell startup as before
+        completion = None
+
+    if completion is None:
+        if shell_name == "fish":
+            rc_file = home / ".config" / "fish" / "config.fish"
+            source_cmd = f"register-python-argcomplete {script_path} | source"
+        else:
+            source_cmd = f'eval "$(register-python-argcomplete {script_path})"'
+        completion_file = rc_file
+    else:
+        completion_file.parent.mkdir(parents=True, exist_ok=True)
+        completion_file.write_text(completion)
+        print(f"Wrote completion script to {completion_file}")
+        source_cmd = f"source {completion_file}"
+
+    if rc_file:
+        # Append to rc file if not already present
+        rc_file.parent.mkdir(parents=True, exist_ok=True)
+        contents = rc_file.read_text() if rc_file.exists() else ""
+        if source_cmd not in contents:
+            with rc_file.open("a") as f:
+                f.write(f"\n# Enable argcomplete for Metronome\n{source_cmd}\n")
+        print(f"Added completion to {rc_file}")
+
+    # Sourcing from a subshell has no effect on the user's shell, so just tell them
+    print(f"Restart your shell or run: source {completion_file}")
+    print(
+        "Make sure ~/.local/bin is in your PATH to use this script with completion."
+    )
+    sys.exit(0)
@@ -1,16 +1,132 @@
 import os
-import shutil
+import re
+import time
+import tempfile
 from pathlib import Path
-from subprocess import Popen, PIPE, STDOUT
-from tqdm import tqdm  # type: ignore
+from subprocess import Popen, PIPE, DEVNULL, run
 from datetime import datetime
-import json
 
+from libs.fileutils import which
+from libs.jsonutils import loads
 
-def ffprobe(file: Path, bin_location: str = "bin") -> dict:
-    json_packed = ""
+# ffmpeg -progress reports the current output position in microseconds
+_OUT_TIME = re.compile(rb"out_time_us=(\d+)")
+# Minimum seconds between progress bar refreshes
+_REFRESH_INTERVAL = 0.25
+# Read ffmpeg's progress pipe in large blocks rather than line by line
+_PIPE_BUFFER = 1 << 16
+
+_OPUS_ARGS = (
+    "-c:a",
+    "libopus",
+    "-b:a",
+    "384k",
+    "-vbr",
+    "on",
+    "-compression_level",
+    "10",
+    "-map_metadata",
+    "0",
+    "-progress",
+    "pipe:1",
+    "-loglevel",
+    "error",
+    "-f",
+    "opus",
+)
+_MP3_ARGS = (
+    "-ab",
+    "320k",
+    "-vcodec",
+    "copy",
+    "-map_metadata",
+    "0",
+    "-id3v2_version",
+    "3",
+    "-progress",
+    "pipe:1",
+    "-loglevel",
+    "error",
+    "-f",
+    "mp3",
+)
+_OPUS_COPY_ARGS = (
+    "-c:a",
+    "copy",
+    "-map_metadata",
+    "0",
+    "-progress",
+    "pipe:1",
+    "-loglevel",
+    "error",
+    "-f",
+    "opus",
+)
+_MP3_COPY_ARGS = (
+    "-c",
+    "copy",
+    "-map_metadata",
+    "0",
+    "-id3v2_version",
+    "3",
+    "-progress",
+    "pipe:1",
+    "-loglevel",
+    "error",
+    "-f",
+    "mp3",
+)
+# Output format -> (codec arguments, file extension)
+_FORMAT_TABLE = {
+    "opus": (_OPUS_ARGS, ".opus"),
+    "mp3": (_MP3_ARGS, ".mp3"),
+}
+# Output format -> codec arguments when the input already uses that format
+_COPY_TABLE = {
+    "opus": _OPUS_COPY_ARGS,
+    "mp3": _MP3_COPY_ARGS,
+}
+
+
+def _resolve_bin(name: str, bin_location: str) -> str:
+    # which() is cached, so PATH is only walked once per binary
+    return which(name) or os.path.join(bin_location, name)
+
+
+def _ffmpeg_threads(workers) -> int:
+    # Split the cores between concurrent ffmpeg processes; a single worker lets ffmpeg decide (0)
+    try:
+        workers = int(workers)
+    except (ValueError, TypeError):
+        workers = 1
+
+    if workers <= 1:
+        return 0
+
+    return max(1, (os.cpu_count() or 2) // workers)
+
+
+def flac_duration(file: Path) -> float | None:
+    # STREAMINFO is always the first metadata block, right after the fLaC marker
+    with open(file, "rb") as flac:
+        header = flac.read(42)
+
+    if len(header) < 42 or header[:4] != b"fLaC" or header[4] & 0x7F != 0:
+        return None
+
+    # 20 bits sample rate, 3 bits channels, 5 bits bits-per-sample, 36 bits total samples
+    packed = int.from_bytes(header[18:26], "big")
+    sample_rate = packed >> 44
+    total_samples = packed & ((1 << 36) - 1)
+
+    if not sample_rate or not total_samples:
+        return None
 
-    ffprobe_path = shutil.which("ffprobe") or os.path.join(bin_location, "ffprobe")
+    return total_samples / sample_rate
+
+
+def ffprobe(file: Path, bin_location: str = "bin") -> dict:
+    ffprobe_path = _resolve_bin("ffprobe", str(bin_location))
     ffprobe_command = [
         ffprobe_path,
         "-v",
@@ -21,20 +137,10 @@ def ffprobe(file: Path, bin_location: str = "bin") -> dict:
         "json",
         str(file),
     ]
-    with Popen(
-        ffprobe_command,
-        shell=False,
-        stdout=PIPE,
-        stderr=STDOUT,
-        universal_newlines=True,
-    ) as probe:
-        for line in probe.stdout:  # type: ignore
-            json_packed += line
+    # Read the whole JSON blob in one go, the parser accepts bytes directly
+    probe = run(ffprobe_command, shell=False, stdout=PIPE, stderr=DEVNULL, check=False)
 
-        # Make sure no ghost processes stay
-        probe.kill()
-
-    return json.loads(json_packed)
+    return loads(probe.stdout or b"{}")
 
 
 def ffmpeg(
@@ -43,102 +149,116 @@ def ffmpeg(
     file_out_name: str,
     metronome_settings,
     bin_location: str,
-    queue,
     logger,
     **kwargs,
-) -> bool:
-    ffmpeg_path = shutil.which("ffmpeg") or os.path.join(bin_location, "ffmpeg")
+) -> dict:
+    from tqdm import tqdm  # type: ignore
+
+    ffmpeg_path = _resolve_bin("ffmpeg", str(bin_location))
     output_format = metronome_settings.get("convert", "mp3")
-    if output_format == "opus":
-        codec_args = [
-            "-c:a",
-            "libopus",
-            "-b:a",
-            "384k",
-            "-vbr",
-            "on",
-            "-compression_level",
-            "10",
-            "-map_metadata",
-            "0",
-            "-progress",
-            "pipe:1",
-            "-loglevel",
-            "error",
-            "-f",
-            "opus",
-        ]
-        file_out_name = os.path.splitext(file_out_name)[0] + ".opus"
-    else:  # mp3
-        codec_args = [
-            "-ab",
-            "320k",
-            "-vcodec",
-            "copy",
-            "-map_metadata",
-            "0",
-            "-id3v2_version",
-            "3",
-            "-progress",
-            "pipe:1",
-            "-loglevel",
-            "error",
-            "-f",
-            "mp3",
-        ]
-        file_out_name = os.path.splitext(file_out_name)[0] + ".mp3"
+    codec_args, extension = _FORMAT_TABLE.get(output_format, _FORMAT_TABLE["mp3"])
+
+    # Re-encoding lossy audio to the same codec only loses quality, copy the stream instead
+    if in_file.suffix.lower() == extension:
+        codec_args = _COPY_TABLE[extension[1:]]
+    file_out_name = os.path.splitext(file_out_name)[0] + extension
+
+    # Write to a temporary name so an interrupted conversion never looks finished
+    final_file = out_file.with_name(file_out_name)
+    part_file = final_file.with_name(final_file.name + ".part")
+
+    ffmpeg_threads = metronome_settings.get("ffmpeg_threads")
+    if ffmpeg_threads is None:
+        ffmpeg_threads = _ffmpeg_threads(metronome_settings.get("threads", 1))
 
     ffmpeg_command = [
         ffmpeg_path,
         "-y",
+        # Skip stdin polling, banner probing and the stats line; none of them are used
+        "-nostdin",
+        "-hide_banner",
+        "-nostats",
+        # Before -i this applies to decoding, after it to encoding
+        "-threads",
+        str(ffmpeg_threads),
+        "-filter_threads",
+        "1",
         "-i",
         str(in_file),
+        "-threads",
+        str(ffmpeg_threads),
         *codec_args,
-        os.path.join(str(out_file.parent), file_out_name),
+        part_file,
     ]
 
     # Limit our filenames to 40 chars so it looks uniform
     desc = (in_file.name[:37] + "...") if len(in_file.name) > 40 else in_file.name
+    desc_padded = f"{desc:<40}"
+    converted_desc = f"Converted: {desc_padded}"
 
-    ffprobe_info = ffprobe(in_file)
-    status = {}
+    # Reading the FLAC header is far cheaper than spawning ffprobe
+    duration = flac_duration(in_file)
+    if duration is None and metronome_settings.get("probe", True):
+        streams = ffprobe(in_file, bin_location).get("streams") or [{}]
+        duration = float(streams[0].get("duration", 0)) or None
 
     with tqdm(
-        desc=desc,
-        total=round(float(ffprobe_info["streams"][0]["duration"])),
+        desc=desc_padded,
+        total=round(duration) if duration else None,
         unit="s",
         bar_format="{desc:<40}: {percentage:3.0f}%|{bar}|{n_fmt}/{total_fmt} [{elapsed}]({rate_fmt}{postfix})",
         leave=False,
         ascii=True,
-    ) as progress:
+        mininterval=_REFRESH_INTERVAL,
+    ) as progress, tempfile.TemporaryFile() as errors:
         # tqdm.write("Processing: {}".format(in_file))
+        # Keep stderr out of the -progress stream, a file can't fill up and block ffmpeg like a pipe
         with Popen(
             ffmpeg_command,
             shell=False,
             stdout=PIPE,
-            stderr=STDOUT,
-            universal_newlines=True,
+            stderr=errors,
+            bufsize=_PIPE_BUFFER,
             **kwargs,
         ) as process:
-            for line in process.stdout:  # type: ignore
-                stat = line.split("=")
+            pending = b""
+            last_refresh = 0.0
+            total_time = 0
+
+            for chunk in iter(lambda: process.stdout.read1(_PIPE_BUFFER), b""):  # type: ignore
+                # Only scan complete lines so a value is never cut in half
+                complete, _, pending = (pending + chunk).rpartition(b"\n")
+                out_times = _OUT_TIME.findall(complete)
 
-                if len(stat) < 2:
+                if not out_times:
                     continue
 
-                status.update({stat[0]: stat[1]})
+                # Keep the latest position but only publish it once per interval
+                total_time = round(int(out_times[-1]) / 1000000)
 
-                if "out_time_us" in stat and "N/A" not in stat[1]:
-                    total_time = round(float(status["out_time_us"]) / 1000000)
-                    progress.update(total_time - progress.n)
+                now = time.monotonic()
+                if now - last_refresh < _REFRESH_INTERVAL:
+                    continue
+
+                progress.update(total_time - progress.n)
+                last_refresh = now
 
-                progress.refresh()
+            # Publish whatever arrived after the last refresh
+            progress.update(total_time - progress.n)
 
+        if process.returncode == 0:
+            os.replace(part_file, final_file)
             logger.info(f"Converted {in_file} to {file_out_name}")
+        else:
+            if os.path.lexists(part_file):
+                os.remove(part_file)
+
+            errors.seek(0)
+            logger.error(
+                f"ffmpeg failed to convert {in_file}: {errors.read().decode(errors='replace').strip()}"
+            )
 
-            # print(status)
-        progress.set_description_str(f"Converted: {desc:<40}")
+        progress.set_description_str(converted_desc)
         progress.close()
 
-    queue.task_done()
-    return queue.get()
+    return {"file": str(in_file), "ok": process.returncode == 0}
@@ -1,30 +1,63 @@
 import os
-import requests  # type: ignore
-import hashlib
+import shutil
 import stat
-from io import BytesIO
 from pathlib import Path
 from typing import List
-from tqdm import tqdm  # type: ignore
 from sys import platform
 
 
-def extract(in_file: bytes, out_path: Path, needles: List) -> bool:
+# Archive types we know how to extract, keyed by URL suffix
+_ARCHIVE_SUFFIXES = {
+    ".zip": "zip",
+    ".tar.xz": "tar",
+    ".tar.gz": "tar",
+    ".tgz": "tar",
+}
+
+
+def archive_type_from_url(url: str) -> str | None:
+    for suffix, archive_type in _ARCHIVE_SUFFIXES.items():
+        if url.endswith(suffix):
+            return archive_type
+
+    return None
+
+
+def extract(
+    in_file: str, out_path: Path, needles: List, archive_type: str | None = None
+) -> bool:
     from zipfile import ZipFile  # noqa
     from tarfile import TarFile  # noqa
-    import magic  # type: ignore
 
-    def safe_extract_path(base_dir: Path, target_path: Path) -> Path:
-        # Resolve the absolute path and ensure it's within base_dir
-        abs_target = (base_dir / target_path.name).resolve()
-        if not str(abs_target).startswith(str(base_dir.resolve()) + os.sep):
+    resolved_out_path = out_path.resolve()
+
+    def safe_extract_path(target_path: Path) -> Path:
+        # Resolve the absolute path and ensure it's within out_path
+        abs_target = (resolved_out_path / target_path.name).resolve()
+        if abs_target == resolved_out_path or not abs_target.is_relative_to(
+            resolved_out_path
+        ):
             raise ValueError(f"Blocked path traversal attempt: {abs_target}")
         return abs_target
 
-    file_type = magic.from_buffer(in_file, mime=True)
+    def make_executable(file_out) -> None:
+        if platform.startswith("linux"):
+            mode = os.fstat(file_out.fileno()).st_mode
+            os.fchmod(file_out.fileno(), mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH) # type: ignore
+
+    # Only fall back to libmagic when the caller doesn't know the archive type
+    if archive_type is None:
+        import magic  # type: ignore
+
+        file_type = magic.from_file(in_file, mime=True)
+
+        if file_type == "application/x-xz" or file_type == "application/gzip":
+            archive_type = "tar"
+        elif file_type == "application/zip":
+            archive_type = "zip"
 
-    if file_type == "application/x-xz" or file_type == "application/gzip":
-        with TarFile.open(fileobj=BytesIO(in_file), mode="r|*") as tar:
+    if archive_type == "tar":
+        with TarFile.open(name=in_file, mode="r|*") as tar:
             for file in tar:
                 file_path = Path(file.path)
 
@@ -32,43 +65,56 @@ def extract(in_file: bytes, out_path: Path, needles: List) -> bool:
                     continue
 
                 if file_path.stem in needles:
-                    safe_path = safe_extract_path(out_path, file_path)
+                    safe_path = safe_extract_path(file_path)
                     with open(safe_path, "wb") as file_out:
                         file_bytes = tar.extractfile(file)
 
                         if file_bytes is None:
                             continue
 
-                        file_out.write(file_bytes.read())
-
-                        if platform == "Linux":
-                            os.fchmod(file_out.fileno(), stat.S_IEXEC) # type: ignore
-
-                        file_out.close()
-
-    elif file_type == "application/zip":
-        with ZipFile(BytesIO(in_file)) as zip:  # type: ignore
-            files = zip.infolist()
-
-            for file in files:
-                file_path = Path(file.filename)
-
-                if file_path.stem in needles and file_path.suffix in ["", ".exe"]:
-                    safe_path = safe_extract_path(out_path, file_path)
-                    with open(safe_path, "wb") as file_out:
-                        file_out.write(zip.read(str(file.filename)))
-
-                        if platform == "Linux":
-                            os.fchmod(file_out.fileno(), stat.S_IEXEC) # type: ignore
-
-                        file_out.close()
+                        shutil.copyfileobj(file_bytes, file_out, length=1 << 20)
+
+                        make_executable(file_out)
+
+    elif archive_type == "zip":
+        from concurrent.futures import ThreadPoolExecutor, as_completed  # noqa
+
+        def extract_member(name: str) -> None:
+            # ZipFile is not safe to share between threads, so each one gets its own handle
+            with ZipFile(in_file) as zip:  # type: ignore
+                safe_path = safe_extract_path(Path(name))
+                with open(safe_path, "wb") as file_out, zip.open(name) as file_bytes:
+                    shutil.copyfileobj(file_bytes, file_out, length=1 << 20)
+
+                    make_executable(file_out)
+
+        with ZipFile(in_file) as zip:  # type: ignore
+            members = [
+                file.filename
+                for file in zip.infolist()
+                if Path(file.filename).stem in needles
+                and Path(file.filename).suffix in ["", ".exe"]
+            ]
+
+        if members:
+            with ThreadPoolExecutor(
+                max_workers=min(len(members), os.cpu_count() or 1)
+            ) as executor:
+                for future in as_completed(
+                    [executor.submit(extract_member, name) for name in members]
+                ):
+                    future.result()
     else:
         return False
 
     return True
 
 
-def download(url: str, checksum: str | None = None) -> bytes:
+def download(url: str, checksum: str | None = None, position: int | None = None) -> str:
+    import hashlib
+    import tempfile
+    import requests  # type: ignore
+    from tqdm import tqdm  # type: ignore
 
     try:
         file_request = requests.get(url, stream=True)
@@ -77,29 +123,40 @@ def download(url: str, checksum: str | None = None) -> bytes:
         raise RuntimeError(f"Failed to download {url}: {e}")
 
     file_size = int(file_request.headers.get("Content-Length", 0))
-    file = bytearray()
+    # Hash each block as it arrives instead of making a second pass at the end
+    file_hash = hashlib.sha256()
 
     print("Downloading: {}".format(url))
 
-    with tqdm(
+    # Stream straight to disk so the archive is never held in memory
+    with tempfile.NamedTemporaryFile(
+        prefix="metronome-", delete=False
+    ) as file, tqdm(
         total=file_size,
         unit="B",
         unit_scale=True,
+        position=position,
     ) as file_progress_bar:
-        for block in file_request.iter_content(1024):
-            file_progress_bar.update(len(block))
-            file.extend(block)
-
-        # Check if download completed
-        if file_size != 0 and file_progress_bar.n != file_size:
-            raise RuntimeError("Unable to download: {}".format(url))
-
-    calculated_checksum = hashlib.sha256(file).hexdigest()
-    if calculated_checksum != checksum:
-        raise RuntimeError(
-            "{} checksums do not match! Please obtain from trusted source. {} Expected: {} {} Found: {}".format(
-                url, os.linesep, checksum, os.linesep, calculated_checksum
-            )
-        )
-
-    return bytes(file)
+        try:
+            for block in file_request.iter_content(1 << 20):
+                file_progress_bar.update(len(block))
+                file_hash.update(block)
+                file.write(block)
+
+            # Check if download completed
+            if file_size != 0 and file_progress_bar.n != file_size:
+                raise RuntimeError("Unable to download: {}".format(url))
+
+            calculated_checksum = file_hash.hexdigest()
+            if calculated_checksum != checksum:
+                raise RuntimeError(
+                    "{} checksums do not match! Please obtain from trusted source. {} Expected: {} {} Found: {}".format(
+                        url, os.linesep, checksum, os.linesep, calculated_checksum
+                    )
+                )
+        except BaseException:
+            file.close()
+            os.remove(file.name)
+            raise
+
+    return file.name
@@ -1,20 +1,40 @@
 import os
+import re
+import shutil
 import pathlib
+import functools
+from typing import Collection, Iterator
+
+# Forbidden characters for Windows and Unix filesystems plus ASCII control characters
+_UNSAFE_NAME_RE = re.compile(r'[<>:"/\\|?*\x00-\x1f]')
+
+
+@functools.lru_cache(maxsize=1)
+def _cwd() -> str:
+    # The working directory does not change during a run, so only ask once
+    return os.path.abspath(pathlib.Path.cwd())
+
+
+@functools.lru_cache(maxsize=16)
+def which(name: str) -> str | None:
+    # Every lookup walks PATH, and the same few binaries are asked for repeatedly
+    return shutil.which(name)
 
 
 def make_dir(directory: str) -> str:
-    current_working_dir = pathlib.Path.cwd()
+    base_dir = _cwd()
 
     if not os.path.isabs(directory):
-        directory = os.path.join(current_working_dir, directory)
+        directory = os.path.join(base_dir, directory)
     directory = os.path.abspath(directory)
 
-    base_dir = os.path.abspath(current_working_dir)
-    if not directory.startswith(base_dir + os.sep) and directory != base_dir:
+    if directory == base_dir:
+        return directory
+
+    if not directory.startswith(base_dir + os.sep):
         raise ValueError(f"Path traversal detected: {directory} is outside {base_dir}")
 
-    if not os.path.exists(directory):
-        os.makedirs(directory, exist_ok=True)
+    os.makedirs(directory, exist_ok=True)
 
     return directory
 
@@ -26,33 +46,59 @@ def open_file(filename: pathlib.Path) -> bytes:
     return file_loaded
 
 
+def iter_music_files(root: str, extensions: Collection[str]) -> Iterator[str]:
+    # scandir reads each directory once and DirEntry caches the file type, unlike glob
+    extensions = frozenset(extensions)
+    # An explicit stack keeps one directory handle open at a time, however deep the tree
+    pending = [root]
+    # Symlinked directories are followed like glob did, (device, inode) pairs stop cycles
+    visited = set()
+
+    while pending:
+        directory = pending.pop()
+        directory_stat = os.stat(directory)
+        directory_id = (directory_stat.st_dev, directory_stat.st_ino)
+
+        if directory_id in visited:
+            continue
+        visited.add(directory_id)
+
+        subdirs = []
+
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                # Hidden entries are skipped, matching glob's behaviour
+                if entry.name.startswith("."):
+                    continue
+
+                if entry.is_dir():
+                    subdirs.append(entry.path)
+                elif os.path.splitext(entry.name)[1][1:].lower() in extensions:
+                    yield entry.path
+
+        # Reversed so directories are still visited in listing order
+        pending.extend(reversed(subdirs))
+
+
+@functools.lru_cache(maxsize=64)
+def _abspath(path: str) -> str:
+    # Base directories repeat on every check, only normalize them once
+    return os.path.abspath(path)
+
+
 def is_safe_path(base_dir: str, path: str) -> bool:
     # Prevent path traversal and ensure path is within base_dir
-    abs_base = os.path.abspath(base_dir)
+    abs_base = _abspath(base_dir)
     abs_path = os.path.abspath(path)
     return abs_path.startswith(abs_base + os.sep) or abs_path == abs_base
 
 
 def is_safe_filename(filename: str) -> bool:
-    # Disallow forbidden characters for Windows and Unix filesystems
-    forbidden = '<>:"/\\|?*\0'
-
-    # if metronome_settings["debug"]:
-    #     print(f"Checking: {repr(filename)}")
-    #     print(f"Forbidden: {any(char in filename for char in forbidden)}")
-    #     print(f"Control: {any(ord(char) < 32 for char in filename)}")
-    #     print(f"Strip: {filename.strip(' .') != filename}")
-    #     print(f"Empty: {not filename}")
-
-    if any(char in filename for char in forbidden):
-        return False
-    # Disallow ASCII control characters
-    if any(ord(char) < 32 for char in filename):
+    # Disallow empty filenames
+    if not filename:
         return False
     # Disallow leading/trailing spaces or dots
     if filename.strip(" .") != filename:
         return False
-    # Disallow empty filenames
-    if not filename:
-        return False
-    return True
+    # Disallow forbidden and control characters in a single scan
+    return _UNSAFE_NAME_RE.search(filename) is None
@@ -0,0 +1,22 @@
+# orjson is optional, fall back to the standard library when it isn't installed
+try:
+    import orjson  # type: ignore
+
+    JSONDecodeError = orjson.JSONDecodeError
+
+    def loads(data: str | bytes):
+        return orjson.loads(data)
+
+    def dumps(obj, sort_keys: bool = False) -> str:
+        return orjson.dumps(obj, option=orjson.OPT_SORT_KEYS if sort_keys else 0).decode()
+
+except ImportError:
+    import json
+
+    JSONDecodeError = json.JSONDecodeError
+
+    def loads(data: str | bytes):
+        return json.loads(data)
+
+    def dumps(obj, sort_keys: bool = False) -> str:
+        return json.dumps(obj, sort_keys=sort_keys)
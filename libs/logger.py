@@ -1,6 +1,12 @@
 import logging
 import sys
 
+_FORMATTER = logging.Formatter(
+    fmt="[%(asctime)s]: %(levelname)-8s | %(filename)s:%(lineno)d | %(message)s",
+    datefmt="%Y-%m-%d %H:%M:%S",
+)
+_CONFIGURED = False
+
 
 class ConsoleFilter(logging.Filter):
     def filter(self, record):
@@ -13,36 +19,43 @@ class StderrFilter(logging.Filter):
 
 
 def setup_logging(logfile=None, level=logging.INFO):
-    formatter = logging.Formatter(
-        fmt="[%(asctime)s]: %(levelname)-8s | %(filename)s:%(lineno)d | %(message)s",
-        datefmt="%Y-%m-%d %H:%M:%S",
-    )
+    global _CONFIGURED
 
     logger = logging.getLogger()
     logger.setLevel(level)
+
+    # Handlers are already in place, only the level needs updating
+    if _CONFIGURED:
+        for handler in logger.handlers:
+            if not any(isinstance(f, StderrFilter) for f in handler.filters):
+                handler.setLevel(level)
+        return
+
     logger.handlers.clear()
 
     # Stdout handler for INFO and below
     stdout_handler = logging.StreamHandler(sys.stdout)
     stdout_handler.setLevel(level)
     stdout_handler.addFilter(ConsoleFilter())
-    stdout_handler.setFormatter(formatter)
+    stdout_handler.setFormatter(_FORMATTER)
     logger.addHandler(stdout_handler)
 
     # Stderr handler for ERROR and above
     stderr_handler = logging.StreamHandler(sys.stderr)
     stderr_handler.setLevel(logging.ERROR)
     stderr_handler.addFilter(StderrFilter())
-    stderr_handler.setFormatter(formatter)
+    stderr_handler.setFormatter(_FORMATTER)
     logger.addHandler(stderr_handler)
 
     # Optional file handler
     if logfile:
         file_handler = logging.FileHandler(logfile)
         file_handler.setLevel(level)
-        file_handler.setFormatter(formatter)
+        file_handler.setFormatter(_FORMATTER)
         logger.addHandler(file_handler)
 
+    _CONFIGURED = True
+
 
 # Example usage:
 # setup_logging("mylogfile.log", logging.DEBUG)
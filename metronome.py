@@ -1,38 +1,42 @@
 #!/usr/bin/env python3
 
 import platform
-
-system = platform.system()
-
-if system != "Linux" and system != "Windows":
-    raise RuntimeError("{} is not supported.".format(system))
-
 import os
 import sys
 from pathlib import Path
-from glob import glob
-from tqdm import tqdm  # type: ignore
-import atexit
-import pathlib
-import json
 import shutil
-from threading import Thread
-from queue import Queue
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
 from datetime import datetime
+from queue import Queue
+from threading import Thread
 
-from libs.cli import get_parser
-from libs.deps import download, extract
-from libs.fileutils import make_dir, is_safe_path, is_safe_filename
-from libs.convert import ffmpeg
+from libs.cli import get_parser, install_completion
+from libs.fileutils import (
+    make_dir,
+    is_safe_path,
+    is_safe_filename,
+    iter_music_files,
+    which,
+)
+from libs.jsonutils import loads, dumps, JSONDecodeError
 from libs.logger import setup_logging, logging
 
 
 def main():
+    system = platform.system()
+
+    if system != "Linux" and system != "Windows":
+        raise RuntimeError("{} is not supported.".format(system))
+
     parser = get_parser()
     args = parser.parse_args()
+
+    if args.install_completion:
+        install_completion()
+
     metronome_settings = vars(args)
 
-    active_user_dir = pathlib.Path.home()
+    active_user_dir = Path.home()
     metronome_json_settings = os.path.join(active_user_dir, ".metronome.json")
 
     # Translate CLI debug settings to logging constants
@@ -56,38 +60,49 @@ def main():
     ]
     file_handlers = [h for h in logger.handlers if isinstance(h, logging.FileHandler)]
 
-    if os.path.exists(metronome_json_settings):
-        try:
-            with open(metronome_json_settings, "r") as settings_json:
-                file_settings = json.loads(settings_json.read())
-                for key, file_value in file_settings.items():
-                    cli_value = metronome_settings.get(key)
-                    # Check if the user explicitly set this flag via CLI
-                    if hasattr(args, key) and getattr(args, key) is not None:
-                        # User explicitly set this flag, use CLI value (even if it's the default)
-                        continue
-                    # If CLI value is not set (None) or matches the default, use file value
-                    if cli_value is None or cli_value == parser.get_default(key):
-                        metronome_settings[key] = file_value
-        except json.JSONDecodeError as e:
-            logging.error(f"Failed to parse settings file: {e}")
-        except Exception as e:
-            logging.error(f"An unexpected error occurred while loading settings: {e}")
+    # Serialized form of what is on disk, used to skip rewriting unchanged settings
+    saved_settings = None
+
+    # Opening directly saves an exists() stat, a missing file is the same as no settings
+    try:
+        with open(metronome_json_settings, "rb") as settings_json:
+            file_settings = loads(settings_json.read())
+            saved_settings = dumps(file_settings, sort_keys=True)
+            for key, file_value in file_settings.items():
+                cli_value = metronome_settings.get(key)
+                # Check if the user explicitly set this flag via CLI
+                if hasattr(args, key) and getattr(args, key) is not None:
+                    # User explicitly set this flag, use CLI value (even if it's the default)
+                    continue
+                # If CLI value is not set (None) or matches the default, use file value
+                if cli_value is None or cli_value == parser.get_default(key):
+                    metronome_settings[key] = file_value
+    except FileNotFoundError:
+        pass
+    except JSONDecodeError as e:
+        logging.error(f"Failed to parse settings file: {e}")
+    except Exception as e:
+        logging.error(f"An unexpected error occurred while loading settings: {e}")
 
     logging.debug("Metronome settings: %s", metronome_settings)
 
-    @atexit.register
-    def termination_handler():
-        try:
-            with open(metronome_json_settings, "w") as settings_json:
-                settings_json.write(json.dumps(metronome_settings))
-        except Exception as e:
-            logging.error(f"Failed to save settings on exit: {e}")
+    def save_settings():
+        if not metronome_settings.get("save_settings", True):
+            return
 
-        logging.info("Metronome terminated gracefully.")
+        payload = dumps(metronome_settings, sort_keys=True)
+
+        if payload != saved_settings:
+            try:
+                # Write next to the real file and swap it in so a crash can't truncate it
+                temp_settings = metronome_json_settings + ".tmp"
+                with open(temp_settings, "w") as settings_json:
+                    settings_json.write(payload)
+                os.replace(temp_settings, metronome_json_settings)
+            except Exception as e:
+                logging.error(f"Failed to save settings: {e}")
 
     bin_location = Path(os.getcwd(), "bin")
-    current_working_dir = os.getcwd()
 
     # Ensure input and output are provided
     if not metronome_settings.get("input"):
@@ -120,52 +135,67 @@ def main():
         metronome_settings["analyze"] = True
 
     try:
-        with open("deps.json", "r") as deps_file:
-            programs = json.load(deps_file)
+        with open("deps.json", "rb") as deps_file:
+            programs = loads(deps_file.read())
     except FileNotFoundError:
         raise RuntimeError(
             "deps.json file not found. Please ensure it exists in the working directory."
         )
-    except json.JSONDecodeError as e:
+    except JSONDecodeError as e:
         raise RuntimeError(f"Failed to parse deps.json: {e}")
     except Exception as e:
         raise RuntimeError(f"An unexpected error occurred while loading deps.json: {e}")
 
+    def fetch_and_extract(program: str, needles: list, position: int) -> None:
+        # Only pulled in when a bundled binary is actually missing
+        from libs.deps import download, extract, archive_type_from_url
+
+        archive = download(
+            programs[program][system]["url"],
+            programs[program][system]["checksum"],
+            position,
+        )
+
+        try:
+            archive_type = archive_type_from_url(programs[program][system]["url"])
+            if not extract(archive, bin_location, needles, archive_type):
+                raise RuntimeError(
+                    "Unable to extract {}, please obtain manually.".format(
+                        programs[program][system]["url"]
+                    )
+                )
+        finally:
+            os.remove(archive)
+
+    missing_programs = []
+
     if (
         metronome_settings["convert"]
-        and shutil.which("ffmpeg") is None
+        and which("ffmpeg") is None
         and not os.path.exists(os.path.join(bin_location, "ffmpeg"))
     ):
-        ffmpeg_archive = download(
-            programs["ffmpeg"][system]["url"], programs["ffmpeg"][system]["checksum"]
-        )
-
-        if not extract(ffmpeg_archive, bin_location, ["ffmpeg", "ffprobe"]):
-            raise RuntimeError(
-                "Unable to extract {}, please obtain manually.".format(
-                    programs["ffmpeg"][system]["url"]
-                )
-            )
+        missing_programs.append(("ffmpeg", ["ffmpeg", "ffprobe"]))
 
     if (
         metronome_settings["analyze"]
-        and shutil.which("fpcalc") is None
+        and which("fpcalc") is None
         and not os.path.exists(os.path.join(bin_location, "fpcalc"))
     ):
-        chromaprint_archive = download(
-            programs["chromaprint"][system]["url"],
-            programs["chromaprint"][system]["checksum"],
-        )
-
-        if not extract(chromaprint_archive, bin_location, ["fpcalc"]):
-            raise RuntimeError(
-                "Unable to extract {}, please obtain manually.".format(
-                    programs["chromaprint"][system]["url"]
-                )
-            )
+        missing_programs.append(("chromaprint", ["fpcalc"]))
+
+    if missing_programs:
+        # The archives are independent, so download and extract them concurrently
+        with ThreadPoolExecutor(max_workers=len(missing_programs)) as executor:
+            for future in as_completed(
+                [
+                    executor.submit(fetch_and_extract, program, needles, position)
+                    for position, (program, needles) in enumerate(missing_programs)
+                ]
+            ):
+                future.result()
 
     # Common music file extensions
-    music_extensions = [
+    music_extensions = {
         "flac",
         "mp3",
         "wav",
@@ -175,30 +205,33 @@ def main():
         "wma",
         "alac",
         "aiff",
-    ]
+    }
 
     # Allow user to specify additional extensions via CLI/settings
     extra_exts = metronome_settings.get("extra_extensions")
     if extra_exts:
-        # Split by comma, strip whitespace, and filter out empty strings
-        user_exts = [
-            ext.strip().lower() for ext in extra_exts.split(",") if ext.strip()
-        ]
-        music_extensions.extend(
-            [ext for ext in user_exts if ext not in music_extensions]
+        # The CLI already splits the list, older saved settings may still hold a string
+        if isinstance(extra_exts, str):
+            extra_exts = extra_exts.split(",")
+        music_extensions.update(
+            ext.strip().lstrip(".").lower() for ext in extra_exts if ext.strip()
         )
 
-    files = []
+    # Frozen once so the walk does a hash lookup per file
+    music_extensions = frozenset(music_extensions)
+
+    input_dir = metronome_settings["input"]
+    output_dir = metronome_settings["output"]
+    # Converted files must not be picked up again when the output lives inside the input
+    output_prefix = os.path.join(output_dir, "") if output_dir != input_dir else None
+
+    def discover_files():
+        for file in iter_music_files(input_dir, music_extensions):
+            if output_prefix and file.startswith(output_prefix):
+                continue
 
-    for ext in music_extensions:
-        for file in glob(
-            os.path.join(
-                current_working_dir, metronome_settings["input"], "**", f"*.{ext}"
-            ),
-            recursive=True,
-        ):
             # Check for path traversal and unsupported characters
-            if not is_safe_path(metronome_settings["input"], file):
+            if not is_safe_path(input_dir, file):
                 logging.warning(f"Skipping potentially unsafe path: {file}")
                 continue
 
@@ -207,7 +240,7 @@ def main():
                 logging.warning(f"Skipping file with unsafe name: {file}")
                 continue
 
-            files.append(file)
+            yield file
 
     try:
         threads = int(metronome_settings.get("threads", 1))
@@ -228,80 +261,139 @@ def main():
             exit(1)
 
     if metronome_settings["convert"]:
-        (f"Converting files to {metronome_settings['convert']} format.")
-        thread_list = []
+        # Heavy imports are deferred until a conversion actually runs
+        from tqdm import tqdm  # type: ignore
+        from libs.convert import ffmpeg
+
+        logging.info(f"Converting files to {metronome_settings['convert']} format.")
         convert_count = 0
 
         tqdm.get_lock()
 
-        queue = Queue(maxsize=threads)
-
         logger.info("Passing terminal output to tqdm to avoid broken output.")
 
+        input_root = Path(metronome_settings["input"])
+        output_root = Path(metronome_settings["output"])
+        output_suffix = f".{metronome_settings['convert']}"
+
+        # One walk over the output tree replaces a stat() per input file
+        existing_outputs = (
+            set()
+            if metronome_settings.get("overwrite", False)
+            else set(iter_music_files(str(output_root), [output_suffix[1:]]))
+        )
+
+        def work_items():
+            for file in discover_files():
+                try:
+                    # Map the file under the output folder to maintain original folder structure in output location
+                    file = Path(file)
+                    file_out = (output_root / file.relative_to(input_root)).with_suffix(
+                        output_suffix
+                    )
+                except Exception as e:
+                    tqdm.write(f"Error processing file {file}: {e}")
+                    logging.error(f"Error processing file {file}: {e}")
+                    continue
+
+                # We dont want to convert again
+                if str(file_out) in existing_outputs:
+                    tqdm.write(f"{file_out.name} already exists! Skipping...")
+                    logging.info(f"{file_out.name} already exists! Skipping...")
+                    continue
+
+                yield file, file_out
+
+        # Walk the input tree on its own thread so conversions start with the first file found
+        discovered = Queue(maxsize=1024)
+
+        def walk_input():
+            try:
+                for item in work_items():
+                    discovered.put(item)
+            except Exception as e:
+                logging.error(f"Failed to scan input directory: {e}")
+            finally:
+                discovered.put(None)
+
         with tqdm(
             desc="Total Files",
-            total=len(files),
+            total=None,
             position=(threads + 1),
             leave=False,
             ascii=True,
+            mininterval=0.5,
         ) as total_bar:
 
             # Remove console handlers to avoid breaking tqdm output
             for handler in console_handlers:
                 logger.removeHandler(handler)
 
-            index = 0
-            for index, file in enumerate(files, 1):
-                try:
-                    # Replace input folder with output to maintain original folder structure in output location
-                    file_out = Path(
-                        file.replace(
-                            metronome_settings["input"], metronome_settings["output"]
-                        )
+            # Only start walking once nothing else writes to the console around the bars
+            Thread(target=walk_input, daemon=True).start()
+
+            # At most `threads` ffmpeg processes run at once, with a few more queued behind them
+            max_pending = threads * 2
+
+            with ThreadPoolExecutor(max_workers=threads) as executor:
+                pending = {}
+                # Albums share a parent directory, only create each one once
+                created_dirs = set()
+                file_count = 0
+
+                def reap(block: bool) -> None:
+                    nonlocal convert_count
+
+                    # Advance the total bar as conversions actually finish
+                    done, _ = wait(
+                        pending, timeout=None if block else 0, return_when=FIRST_COMPLETED
                     )
-                    file = Path(file)
 
-                    output_ext = metronome_settings["convert"]
-                    file_out_name = f"{file.stem}.{output_ext}"
+                    for future in done:
+                        file = pending.pop(future)
+                        total_bar.update(1)
+
+                        try:
+                            if future.result()["ok"]:
+                                convert_count += 1
+                        except Exception as e:
+                            tqdm.write(f"Error converting file {file}: {e}")
+                            logging.error(f"Error converting file {file}: {e}")
 
-                    # We dont want to convert again
-                    if os.path.exists(
-                        os.path.join(file_out.parent, file_out_name)
-                    ) and not metronome_settings.get("overwrite", False):
-                        tqdm.write(f"{file_out_name} already exists! Skipping...")
-                        logging.info(f"{file_out_name} already exists! Skipping...")
-                        continue
+                # Only files that still need converting reach this loop
+                for file, file_out in iter(discovered.get, None):
+                    file_count += 1
 
-                    # Create folder structure if does not exist
-                    if not os.path.exists(file_out.parent):
-                        os.makedirs(file_out.parent, exist_ok=True)
+                    # Wait for a slot rather than queueing the whole tree inside the executor
+                    reap(block=len(pending) >= max_pending)
 
-                    thread = Thread(
-                        target=ffmpeg,
-                        args=(
+                    try:
+                        # Create folder structure if does not exist
+                        if file_out.parent not in created_dirs:
+                            file_out.parent.mkdir(parents=True, exist_ok=True)
+                            created_dirs.add(file_out.parent)
+
+                        future = executor.submit(
+                            ffmpeg,
                             file,
                             file_out,
-                            file_out_name,
+                            file_out.name,
                             metronome_settings,
                             bin_location,
-                            queue,
                             logger,
-                        ),
-                    )
-                    queue.put(index)
-                    thread_list.append(thread)
-                    thread.start()
-
-                    convert_count += 1
+                        )
+                        pending[future] = file
+                    except Exception as e:
+                        tqdm.write(f"Error processing file {file}: {e}")
+                        logging.error(f"Error processing file {file}: {e}")
+                        total_bar.update(1)
 
-                    total_bar.update(index - total_bar.n)
-                    total_bar.refresh()
-                except Exception as e:
-                    tqdm.write(f"Error processing file {file}: {e}")
-                    logging.error(f"Error processing file {file}: {e}")
+                # The walk is finished, so the total is finally known
+                total_bar.total = file_count
+                total_bar.refresh()
 
-            # Join threads back into main to free up Queue
-            [thread.join() for thread in thread_list]
+                while pending:
+                    reap(block=True)
 
             # Re-add console handlers
             for handlers in console_handlers:
@@ -309,6 +401,10 @@ def main():
 
         logging.info(f"Total converted files: {convert_count}")
 
+    # Only persist settings once a run has actually completed
+    save_settings()
+    logging.info("Metronome terminated gracefully.")
+
 
 if __name__ == "__main__":
     main()